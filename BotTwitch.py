@@ -1,5 +1,8 @@
+import re
 import socket
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import time
 import json
 import datetime
@@ -7,6 +10,8 @@ import os
 import pytz
 import logging
 import threading
+import queue
+from concurrent.futures import ThreadPoolExecutor
 from typing import Dict, List, Optional
 
 # Налаштування логування
@@ -20,6 +25,25 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+FACEIT_API_BASE = "https://open.faceit.com/data/v4"
+
+# orjson парсить/серіалізує в рази швидше за stdlib json (історія матчів — великі вкладені dict-и)
+try:
+    import orjson
+
+    def _json_loads(data):
+        return orjson.loads(data)
+
+    def _json_dumps(obj) -> str:
+        return orjson.dumps(obj).decode('utf-8')
+
+except ImportError:
+    def _json_loads(data):
+        return json.loads(data)
+
+    def _json_dumps(obj) -> str:
+        return json.dumps(obj, ensure_ascii=False, separators=(',', ':'))
+
 class TwitchFACEITBot:
     """
     Twitch бот для відстеження FACEIT статистики
@@ -44,10 +68,51 @@ class TwitchFACEITBot:
         self.TWITCH_CLIENT_SECRET = os.environ.get("TWITCH_CLIENT_SECRET")  # з ENV
         self.TWITCH_APP_TOKEN = None
         self.TOKEN_EXPIRES_AT = 0  # час, коли токен закінчується (timestamp)
+        self.TWITCH_TOKEN_FILE = os.getenv("TWITCH_TOKEN_FILE", "twitch_token.json")
 
-        self.ELO_FILE = os.getenv("ELO_FILE_PATH", "elo_history.json")
+        self.ELO_FILE = os.getenv("ELO_FILE_PATH", "elo_history.jsonl")
         self.TIMEZONE = pytz.timezone('Europe/Kiev')
 
+        # Спільна HTTP-сесія з пулом з'єднань (без нового TLS-handshake на кожен запит)
+        self.http = requests.Session()
+        adapter = HTTPAdapter(
+            pool_connections=4,
+            pool_maxsize=16,
+            # 429 навмисно не в forcelist: urllib3 з'їв би відповідь і підняв
+            # RetryError, тож _note_rate_limit ніколи б її не побачив
+            max_retries=Retry(
+                total=5,
+                backoff_factor=0.5,
+                status_forcelist=[500, 502, 503, 504],
+                respect_retry_after_header=True,
+                allowed_methods=['GET', 'POST']
+            )
+        )
+        self.http.mount('https://', adapter)
+        self.http.headers.update({'Authorization': f'Bearer {self.FACEIT_API_KEY}'})
+
+        # Після 429 вихідні запити до API призупиняються до кінця вікна
+        self._api_blocked_until = 0.0
+
+        # Кеш player_id за ніком (id незмінний, тому довгий TTL)
+        self.player_cache_ttl = 21600  # 6 годин
+        self._player_cache = {}
+
+        # Короткий кеш статистики: сплеск !elo у чаті = один запит до FACEIT
+        self.stats_ttl = 20  # секунди
+        self._stats_cache = {}
+        self._stats_lock = threading.Lock()
+
+        # Результати вже розібраних матчів: match_id -> "win"/"loss"
+        self._seen_matches = {}
+
+        # Таблиця команд: O(1) lookup замість ланцюжка if/elif на кожне повідомлення
+        self._commands = {
+            '!checkelo': self._handle_checkelo_command,
+            '!debug': self._handle_debug_command,
+            '!testapi': self._handle_testapi_command,
+        }
+
         # Перевірка необхідних ENV
         required_env = [
             'TWITCH_OAUTH_TOKEN', 'TWITCH_BOT_NICK', 'TWITCH_CHANNEL',
@@ -57,30 +122,89 @@ class TwitchFACEITBot:
             if not os.environ.get(var):
                 logging.warning(f"⚠️ ENV змінна {var} не задана!")
 
-        # IRC підключення
+        # IRC підключення. Таймаут більший за інтервал серверних PING (~5 хв),
+        # щоб тиша в чаті не розмотувала socket.timeout кожні 30 секунд
+        self.socket_timeout = 360   # секунди
+        self.dead_connection_timeout = 600  # без жодних даних — вважаємо з'єднання мертвим
         self.irc = socket.socket()
-        self.irc.settimeout(30)
+        self.irc.settimeout(self.socket_timeout)
         self.running = False
-
-        # Ініціалізація файлу Elo
+        self._last_activity = time.monotonic()
+
+        # Буферизований рядковий reader поверх сокета (recv може різати рядки навпіл)
+        self._sock_file = None
+        self._privmsg_re = re.compile(r'^:([^!]+)![^ ]+ PRIVMSG #[^ ]+ :(.*)$')
+
+        # Попередньо закодовані IRC-байти: без f-string + encode на кожен send
+        self._privmsg_prefix = f"PRIVMSG #{self.CHANNEL} :".encode('utf-8')
+        self._auth_bytes = (
+            f"PASS {self.TOKEN}\r\n"
+            f"NICK {self.NICK}\r\n"
+            f"JOIN #{self.CHANNEL}\r\n"
+        ).encode('utf-8')
+
+        # Черга вихідних повідомлень: обробники не сплять, ліміт тримає writer-потік
+        self._out_queue = queue.Queue()
+        threading.Thread(target=self._writer_loop, daemon=True).start()
+
+        # Кеш перевірки стріму, щоб не робити HTTP-запит на кожній ітерації циклу
+        self.live_check_interval = 60  # секунди
+        self._last_live_check = 0.0
+        self._last_live_status = False
+
+        # Ініціалізація файлу Elo (JSONL: один запис на рядок)
         if not os.path.exists(self.ELO_FILE):
-            initial_data = [{
+            initial_entry = {
                 "elo": 0,
                 "timestamp": datetime.datetime.now(self.TIMEZONE).isoformat()
-            }]
+            }
             with open(self.ELO_FILE, 'w', encoding='utf-8') as f:
-                json.dump(initial_data, f, indent=2, ensure_ascii=False)
+                f.write(_json_dumps(initial_entry) + '\n')
             logging.info(f"Файл {self.ELO_FILE} створено з початковим значенням Elo = 0")
 
+        # Історія Elo живе в пам'яті; диск — лише холодна копія
+        self.flush_interval = 10  # секунди між скиданнями на диск
+        self._history_lock = threading.Lock()
+        self._elo_history = self._load_elo_history()
+        self._unflushed = []
+        threading.Thread(target=self._flush_loop, daemon=True).start()
+
+        # Токен Twitch живе ~60 днів — підхоплюємо збережений замість нового OAuth
+        self._load_twitch_token()
+
         logging.info("Ініціалізація бота завершена. Elo файл готовий.")
 
         # Планування щоденного обнулення о 4 ранку
-        self.schedule_daily_reset()
+        threading.Thread(target=self._daily_reset_loop, daemon=True).start()
         logging.info("Щоденне обнулення Elo заплановане на 04:00")
 
+    def _load_twitch_token(self):
+        """Читає збережений токен Twitch з диска, якщо він ще дійсний"""
+        try:
+            with open(self.TWITCH_TOKEN_FILE, 'r', encoding='utf-8') as f:
+                data = _json_loads(f.read())
+
+            if data.get('expires_at', 0) - time.time() > 300:
+                self.TWITCH_APP_TOKEN = data['token']
+                self.TOKEN_EXPIRES_AT = data['expires_at']
+                logging.info("🔑 Використовуємо збережений токен Twitch")
+        except FileNotFoundError:
+            pass
+        except (ValueError, KeyError) as e:
+            logging.warning(f"Не вдалося прочитати {self.TWITCH_TOKEN_FILE}: {e}")
+
+    def _save_twitch_token(self):
+        """Атомарно зберігає токен Twitch на диск (tmp-файл + os.replace)"""
+        tmp_path = self.TWITCH_TOKEN_FILE + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.write(_json_dumps({
+                'token': self.TWITCH_APP_TOKEN,
+                'expires_at': self.TOKEN_EXPIRES_AT
+            }))
+        os.replace(tmp_path, self.TWITCH_TOKEN_FILE)
+
     def refresh_twitch_token(self):
         """Отримує новий токен Twitch через Client Credentials"""
-        import time
         try:
             url = (
                 f"https://id.twitch.tv/oauth2/token"
@@ -88,12 +212,14 @@ class TwitchFACEITBot:
                 f"&client_secret={self.TWITCH_CLIENT_SECRET}"
                 f"&grant_type=client_credentials"
             )
-            response = requests.post(url, timeout=10)
+            # Authorization=None прибирає FACEIT-заголовок сесії для запиту до Twitch
+            response = self.http.post(url, headers={'Authorization': None}, timeout=10)
             response.raise_for_status()
-            data = response.json()
+            data = _json_loads(response.content)
 
             self.TWITCH_APP_TOKEN = data['access_token']
             self.TOKEN_EXPIRES_AT = time.time() + data['expires_in'] - 60  # мінус 60 сек запас
+            self._save_twitch_token()
             logging.info(f"🔑 Отримано новий токен Twitch, expires_in={data['expires_in']} сек")
 
         except Exception as e:
@@ -101,61 +227,107 @@ class TwitchFACEITBot:
 
     def ensure_twitch_token(self):
         """Перевіряє, чи токен ще дійсний, і оновлює його, якщо потрібно"""
-        import time
         if not self.TWITCH_APP_TOKEN or time.time() >= self.TOKEN_EXPIRES_AT:
             logging.info("🔄 Токен Twitch закінчився або не існує, оновлюємо...")
             self.refresh_twitch_token()
 
-    def reset_daily_stats(self):
-        """Обнуляє денну статистику (Win/Lose/зміни Elo)"""
+    def _load_elo_history(self) -> List[Dict]:
+        """Читає історію Elo з JSONL-файлу (один запис на рядок)"""
         if not os.path.exists(self.ELO_FILE):
+            return []
+
+        history = []
+        with open(self.ELO_FILE, 'r', encoding='utf-8') as f:
+            for line in f:
+                line = line.strip()
+                if line:
+                    history.append(_json_loads(line))
+        return history
+
+    def _append_elo_records(self, records: List[Dict]):
+        """Дописує записи в кінець JSONL-файлу — O(1) замість перезапису всієї історії"""
+        with open(self.ELO_FILE, 'a', encoding='utf-8') as f:
+            for record in records:
+                f.write(_json_dumps(record) + '\n')
+
+    def _add_elo_records(self, records: List[Dict]):
+        """Додає записи в історію в пам'яті; на диск вони потраплять фоновим скиданням"""
+        with self._history_lock:
+            self._elo_history.extend(records)
+            self._unflushed.extend(records)
+
+    def _flush_elo_history(self):
+        """Скидає на диск записи, які ще не збережені"""
+        with self._history_lock:
+            pending = self._unflushed
+            self._unflushed = []
+
+        if not pending:
             return
 
         try:
-            with open(self.ELO_FILE, 'r', encoding='utf-8') as f:
-                history = json.load(f)
+            self._append_elo_records(pending)
+        except Exception as e:
+            logger.error(f"Помилка при записі історії Elo: {e}")
 
-            last_elo = history[-1]['elo'] if history else 0
-            new_entry = {
-                "elo": last_elo,
-                "timestamp": datetime.datetime.now(self.TIMEZONE).isoformat()
-            }
+    def _flush_loop(self):
+        """Фоновий потік: періодично скидає накопичені записи Elo на диск"""
+        while True:
+            time.sleep(self.flush_interval)
+            self._flush_elo_history()
 
-            with open(self.ELO_FILE, 'w', encoding='utf-8') as f:
-                json.dump([new_entry], f, indent=2, ensure_ascii=False)
+    def reset_daily_stats(self):
+        """Обнуляє денну статистику (Win/Lose/зміни Elo)"""
+        try:
+            with self._history_lock:
+                last_elo = self._elo_history[-1]['elo'] if self._elo_history else 0
+                new_entry = {
+                    "elo": last_elo,
+                    "timestamp": datetime.datetime.now(self.TIMEZONE).isoformat()
+                }
+
+                self._elo_history = [new_entry]
+                self._unflushed = []
+                self._seen_matches = {}
+
+                # Єдине місце, де файл ущільнюється: залишаємо один рядок
+                with open(self.ELO_FILE, 'w', encoding='utf-8') as f:
+                    f.write(_json_dumps(new_entry) + '\n')
 
             logging.info("🔄 Денна статистика обнулена о 4 ранку")
         except Exception as e:
             logging.error(f"Помилка при обнуленні статистики: {e}")
 
-    def schedule_daily_reset(self):
-        """Запускає таймер, який викликає reset_daily_stats щодня о 4 ранку"""
-        now = datetime.datetime.now(self.TIMEZONE)
-        next_reset = now.replace(hour=4, minute=0, second=0, microsecond=0)
-        if now >= next_reset:
-            next_reset += datetime.timedelta(days=1)
+    def _daily_reset_loop(self):
+        """Єдиний фоновий потік: спить до 04:00 і обнуляє статистику щодня
 
-        delay = (next_reset - now).total_seconds()
-        import threading
-        threading.Timer(delay, self._daily_reset_callback).start()
+        Один довгоживучий потік замість ланцюжка threading.Timer
+        (кожен Timer — окремий потік зі своїм стеком); наступний момент
+        обнулення перераховується щоразу від поточного часу.
+        """
+        while True:
+            now = datetime.datetime.now(self.TIMEZONE)
+            next_reset = now.replace(hour=4, minute=0, second=0, microsecond=0)
+            if now >= next_reset:
+                next_reset += datetime.timedelta(days=1)
 
-    def _daily_reset_callback(self):
-        """Викликається таймером, обнуляє статистику і планує наступне обнулення"""
-        self.reset_daily_stats()
-        self.schedule_daily_reset()  # плануємо наступне обнулення
+            time.sleep((next_reset - now).total_seconds())
+            self.reset_daily_stats()
 
     def connect_to_twitch(self) -> bool:
         """Підключення до Twitch IRC"""
         try:
             self.irc = socket.socket()
-            self.irc.settimeout(30)  # Таймаут для підключення
+            self.irc.settimeout(self.socket_timeout)
             self.irc.connect((self.SERVER, self.PORT))
-            
-            # Автентифікація
-            self.irc.send(f"PASS {self.TOKEN}\r\n".encode('utf-8'))
-            self.irc.send(f"NICK {self.NICK}\r\n".encode('utf-8'))
-            self.irc.send(f"JOIN #{self.CHANNEL}\r\n".encode('utf-8'))
-            
+            self._sock_file = self.irc.makefile('rb', buffering=8192)
+            self._last_activity = time.monotonic()
+
+
+            # Автентифікація (один sendall замість трьох send)
+            self.irc.sendall(self._auth_bytes)
+
+
             logger.info(f"✅ Бот {self.NICK} підключився до каналу {self.CHANNEL}")
             return True
             
@@ -174,13 +346,13 @@ class TwitchFACEITBot:
                 'Authorization': f'Bearer {self.TWITCH_APP_TOKEN}'
             }
             url = f"https://api.twitch.tv/helix/streams?user_login={self.CHANNEL}"
-            response = requests.get(url, headers=headers, timeout=10)
+            response = self.http.get(url, headers=headers, timeout=10)
 
             if response.status_code != 200:
                 logger.error(f"Twitch API помилка: {response.status_code}")
                 return False
 
-            data = response.json()
+            data = _json_loads(response.content)
             # Якщо список не порожній, стрім активний
             return len(data.get('data', [])) > 0
 
@@ -188,45 +360,78 @@ class TwitchFACEITBot:
             logger.error(f"Помилка перевірки стріму: {e}")
             return False
 
+    def _is_stream_live_cached(self) -> bool:
+        """Перевірка стріму з кешем: HTTP-запит не частіше ніж раз на live_check_interval"""
+        now = time.monotonic()
+        if now - self._last_live_check >= self.live_check_interval:
+            self._last_live_status = self.is_stream_live()
+            self._last_live_check = now
+        return self._last_live_status
+
     def send_message(self, message: str):
-        """Надіслати повідомлення в чат з контролем частоти та підтримкою Unicode"""
-        try:
-            if not self.irc:
-                logger.warning("IRC не підключено")
-                return
-            
-            # Twitch обмежує швидкість ~20 повідомлень на 30 сек
-            # Робимо невелику паузу між повідомленнями
-            time.sleep(0.5)
+        """Ставить повідомлення в чергу надсилання (без блокування обробника)"""
+        if not self.irc:
+            logger.warning("IRC не підключено")
+            return
 
-            # Надсилаємо повідомлення у чат
-            self.irc.send(f"PRIVMSG #{self.CHANNEL} :{message}\r\n".encode('utf-8'))
+        self._out_queue.put(self._privmsg_prefix + message.encode('utf-8') + b"\r\n")
+        logger.info(f"У черзі на надсилання: {message}")
 
-            logger.info(f"Надіслано: {message}")
+    def _writer_loop(self):
+        """Фоновий потік: надсилає чергу з лімітом Twitch (~20 повідомлень за 30 сек)
 
-        except Exception as e:
-            logger.error(f"Помилка надсилання повідомлення: {e}")
+        Token bucket замість time.sleep(0.5) на кожне повідомлення; все,
+        що вже чекає в черзі, об'єднується в один send.
+        """
+        tokens = 20.0
+        rate = 20 / 30.0  # поповнення токенів за секунду
+        last_refill = time.monotonic()
+
+        while True:
+            batch = [self._out_queue.get()]
+
+            # Забираємо все, що встигло накопичитись, в один виклик send
+            while True:
+                try:
+                    batch.append(self._out_queue.get_nowait())
+                except queue.Empty:
+                    break
+
+            now = time.monotonic()
+            tokens = min(20.0, tokens + (now - last_refill) * rate)
+            last_refill = now
+
+            if tokens < len(batch):
+                time.sleep((len(batch) - tokens) / rate)
+                tokens = float(len(batch))
+                last_refill = time.monotonic()
+            tokens -= len(batch)
+
+            try:
+                if self.irc:
+                    self.irc.sendall(b''.join(batch))
+                    logger.info(f"Надіслано повідомлень: {len(batch)}")
+            except Exception as e:
+                logger.error(f"Помилка надсилання повідомлення: {e}")
     
     def clean_old_elo_records(self):
         """Очищення старих записів (залишаємо тільки поточний день)"""
-        if not os.path.exists(self.ELO_FILE):
-            return
-            
         try:
-            with open(self.ELO_FILE, 'r', encoding='utf-8') as f:
-                history = json.load(f)
-            
             today = datetime.datetime.now(self.TIMEZONE).date()
-            history = [
-                entry for entry in history 
-                if datetime.datetime.fromisoformat(entry['timestamp']).date() >= today
-            ]
-            
-            with open(self.ELO_FILE, 'w', encoding='utf-8') as f:
-                json.dump(history, f, indent=2, ensure_ascii=False)
-                
+
+            with self._history_lock:
+                self._elo_history = [
+                    entry for entry in self._elo_history
+                    if datetime.datetime.fromisoformat(entry['timestamp']).date() >= today
+                ]
+                self._unflushed = []
+
+                with open(self.ELO_FILE, 'w', encoding='utf-8') as f:
+                    for entry in self._elo_history:
+                        f.write(_json_dumps(entry) + '\n')
+
             logger.info(f"Очищено старі записи в {self.ELO_FILE}")
-            
+
         except Exception as e:
             logger.error(f"Помилка при очищенні Elo записів: {e}")
     
@@ -236,19 +441,7 @@ class TwitchFACEITBot:
         data = {"elo": elo, "timestamp": timestamp}
         
         try:
-            # Читаємо існуючу історію
-            if os.path.exists(self.ELO_FILE):
-                with open(self.ELO_FILE, 'r', encoding='utf-8') as f:
-                    history = json.load(f)
-            else:
-                history = []
-            
-            history.append(data)
-            
-            # Зберігаємо оновлену історію
-            with open(self.ELO_FILE, 'w', encoding='utf-8') as f:
-                json.dump(history, f, indent=2, ensure_ascii=False)
-                
+            self._add_elo_records([data])
             logger.info(f"Збережено Elo: {elo} на час {timestamp}")
             
         except Exception as e:
@@ -256,23 +449,26 @@ class TwitchFACEITBot:
     
     def get_daily_elo_change(self) -> int:
         """Отримання зміни Elo за поточний день, починаючи з 04:00"""
-        if not os.path.exists(self.ELO_FILE):
-            logger.info("Файл історії не існує, денна зміна = 0")
+        if not self._elo_history:
+            logger.info("Історія порожня, денна зміна = 0")
             return 0
 
         try:
-            with open(self.ELO_FILE, 'r', encoding='utf-8') as f:
-                history = json.load(f)
+            history = self._elo_history
 
-            now = datetime.datetime.now(self.TIMEZONE)
-            today = now.date()
+            today = datetime.datetime.now(self.TIMEZONE).date()
 
-            # Фільтруємо записи сьогодні після 04:00
-            daily_records = [
-                entry for entry in history
-                if datetime.datetime.fromisoformat(entry['timestamp']).astimezone(self.TIMEZONE).date() == today and
-                datetime.datetime.fromisoformat(entry['timestamp']).astimezone(self.TIMEZONE).hour >= 4
-            ]
+            # Записи йдуть хронологічно: йдемо з кінця і зупиняємось, щойно дата
+            # випадає зі "сьогодні". Дату та годину беремо зрізами ISO-рядка —
+            # без повного парсингу timestamp-а з tz
+            daily_records = []
+            for entry in reversed(history):
+                ts = entry['timestamp']
+                if datetime.date.fromisoformat(ts[:10]) != today:
+                    break
+                if int(ts[11:13]) >= 4:
+                    daily_records.append(entry)
+            daily_records.reverse()
 
             if not daily_records:
                 logger.info("Записів після 04:00 сьогодні нема, денна зміна = 0")
@@ -289,118 +485,151 @@ class TwitchFACEITBot:
             logger.error(f"Помилка при читанні історії Elo: {e}")
             return 0
     
+    def _note_rate_limit(self, response):
+        """Після 429 блокує запити до API на вікно з Retry-After (щоб не влетіти в бан)"""
+        if response.status_code != 429:
+            return
+
+        try:
+            retry_after = float(response.headers.get('Retry-After', 30))
+        except ValueError:
+            retry_after = 30.0
+
+        self._api_blocked_until = time.monotonic() + retry_after
+        logger.warning(f"⚠️ Отримали 429 від API, пауза {retry_after:.0f} сек")
+
+    def _resolve_player(self, nickname: str) -> Optional[str]:
+        """Повертає player_id для ніка, кешуючи результат (id гравця не змінюється)"""
+        cached = self._player_cache.get(nickname)
+        if cached and time.monotonic() - cached[1] < self.player_cache_ttl:
+            return cached[0]
+
+        player_url = f"{FACEIT_API_BASE}/players?nickname={nickname}"
+        response = self.http.get(player_url, timeout=10)
+        self._note_rate_limit(response)
+        response.raise_for_status()
+
+        player_id = _json_loads(response.content).get('player_id')
+        if player_id:
+            self._player_cache[nickname] = (player_id, time.monotonic())
+        return player_id
+
     def get_faceit_stats(self, nickname: str) -> Dict[str, int]:
-        """Отримання статистики з FACEIT API"""
-        headers = {'Authorization': f'Bearer {self.FACEIT_API_KEY}'}
-        
+        """Отримання статистики з FACEIT API з коротким кешем (stats_ttl секунд)"""
+        cached = self._stats_cache.get(nickname)
+        if cached and time.monotonic() - cached[0] < self.stats_ttl:
+            return cached[1]
+
+        # Після 429 не б'ємо API до кінця вікна — віддаємо останні відомі дані
+        if time.monotonic() < self._api_blocked_until:
+            logger.warning("FACEIT API тимчасово заблоковано (429), віддаємо кеш")
+            return cached[1] if cached else self._get_empty_stats()
+
+        with self._stats_lock:
+            # Поки чекали на lock, інший потік міг уже зробити запит
+            cached = self._stats_cache.get(nickname)
+            if cached and time.monotonic() - cached[0] < self.stats_ttl:
+                return cached[1]
+
+            stats = self._fetch_faceit_stats(nickname)
+
+            # Невдалий запит не затирає останні добрі дані в кеші
+            if stats['Elo'] > 0 or not cached:
+                self._stats_cache[nickname] = (time.monotonic(), stats)
+                return stats
+
+            logger.warning("FACEIT API недоступне, віддаємо останні відомі дані")
+            return cached[1]
+
+    def _fetch_faceit_stats(self, nickname: str) -> Dict[str, int]:
+        """Безпосередній запит статистики до FACEIT API (без кешу)"""
         try:
-            # Отримуємо базову інформацію про гравця
-            player_url = f"https://open.faceit.com/data/v4/players?nickname={nickname}"
-            response = requests.get(player_url, headers=headers, timeout=10)
-            
-            if response.status_code != 200:
-                logger.error(f"Помилка API players: статус {response.status_code}")
-                return self._get_empty_stats()
-            
-            player_data = response.json()
-            player_id = player_data.get('player_id')
-            
+            player_id = self._resolve_player(nickname)
+
             if not player_id:
                 logger.error("Не знайдено player_id")
                 return self._get_empty_stats()
-            
-            # Отримуємо Elo
+
+            # Elo читаємо за кешованим id — без повторного пошуку за ніком
+            player_url = f"{FACEIT_API_BASE}/players/{player_id}"
+            response = self.http.get(player_url, timeout=10)
+            self._note_rate_limit(response)
+            response.raise_for_status()
+
+            player_data = _json_loads(response.content)
             cs2_stats = player_data.get('games', {}).get('cs2', {})
             elo = cs2_stats.get('faceit_elo', 0)
             
             # Отримуємо матчі за сьогодні
-            wins, losses = self._get_daily_matches(player_id, headers)
+            wins, losses = self._get_daily_matches(player_id)
             
             stats = {'Elo': elo, 'Win': wins, 'Lose': losses}
             logger.info(f"Отримано статистику: {stats}")
             return stats
             
-        except requests.RequestException as e:
+        except (requests.RequestException, ValueError, KeyError) as e:
             logger.error(f"Помилка запиту до FACEIT API: {e}")
             return self._get_empty_stats()
-        except Exception as e:
-            logger.error(f"Неочікувана помилка при отриманні статистики: {e}")
-            return self._get_empty_stats()
     
-    def _get_daily_matches(self, player_id: str, headers: Dict[str, str]) -> tuple[int, int]:
+    def _get_daily_matches(self, player_id: str) -> tuple[int, int]:
         """Отримання матчів за поточний день (корекція з UTC)"""
         try:
-            # Використовуємо UTC для API
-            today_utc = datetime.datetime.utcnow().date()
-            from_time = int(datetime.datetime.combine(today_utc, datetime.time(0, 0)).timestamp())
-            to_time = int(datetime.datetime.utcnow().timestamp())
-            
-            logger.info(f"🔍 Пошук матчів з {datetime.datetime.utcfromtimestamp(from_time)} до {datetime.datetime.utcfromtimestamp(to_time)} (UTC)")
+            # Межі доби в UTC — цілочисельна арифметика без datetime-об'єктів
+            # (utcnow/utcfromtimestamp застарілі з Python 3.12)
+            to_time = int(time.time())
+            from_time = to_time - (to_time % 86400)  # опівніч UTC
+
+            logger.info(f"🔍 Пошук матчів з {from_time} до {to_time} (UTC epoch)")
             
-            matches_url = f"https://open.faceit.com/data/v4/players/{player_id}/history"
+            matches_url = f"{FACEIT_API_BASE}/players/{player_id}/history"
             params = {'game': 'cs2', 'from': from_time, 'to': to_time, 'limit': 100}  # збільшений ліміт
-            
-            response = requests.get(matches_url, headers=headers, params=params, timeout=15)
-            if response.status_code != 200:
-                logger.error(f"❌ Помилка API matches: статус {response.status_code}, відповідь: {response.text}")
-                return 0, 0
-            
-            matches_data = response.json()
+
+            response = self.http.get(matches_url, params=params, timeout=15)
+            self._note_rate_limit(response)
+            response.raise_for_status()
+
+
+            matches_data = _json_loads(response.content)
             matches = matches_data.get('items', [])
             logger.info(f"📈 Знайдено матчів: {len(matches)}")
             
             wins = 0
             losses = 0
-            
-            for i, match in enumerate(matches):
-                logger.info(f"🎮 Обробка матчу {i+1}/{len(matches)} - {match.get('match_id')}")
-                result = self._analyze_match(match, player_id)
+
+            for match in matches:
+                match_id = match.get('match_id')
+
+                # Розбираємо кожен матч один раз; повторні !elo беруть результат з кешу
+                result = self._seen_matches.get(match_id)
+                if result is None and match.get("status") == "finished":
+                    # Зворотний індекс player_id -> faction: один dict-lookup
+                    # замість обходу складів обох команд
+                    pid2fac = {
+                        p.get("player_id"): faction
+                        for faction, team_data in match.get("teams", {}).items()
+                        for p in team_data.get("players", ())
+                    }
+                    faction = pid2fac.get(player_id)
+                    winner = match.get("results", {}).get("winner")
+
+                    if faction and winner:
+                        result = "win" if faction == winner else "loss"
+                        if match_id:
+                            self._seen_matches[match_id] = result
+
                 if result == "win":
                     wins += 1
                 elif result == "loss":
                     losses += 1
-            
+
             logger.info(f"📊 Фінальний результат за день: Wins={wins}, Losses={losses}")
             return wins, losses
-        
-        except Exception as e:
+
+        except (requests.RequestException, ValueError, KeyError) as e:
             logger.error(f"Помилка при отриманні матчів: {e}")
             return 0, 0
 
-    def _analyze_match(self, match: Dict, player_id: str) -> str:
-        try:
-            if match.get("status") != "finished":
-                return "unknown"
-
-            teams = match.get("teams", {})
-            results = match.get("results", {})
-
-            # 1. Знайти команду гравця
-            player_team = None
-            for faction, team_data in teams.items():
-                for p in team_data.get("players", []):
-                    if p.get("player_id") == player_id:
-                        player_team = faction
-                        break
-                if player_team:
-                    break
-
-            if not player_team:
-                return "unknown"
-
-            # 2. Перевірити переможця
-            winner = results.get("winner")
-            if not winner:
-                return "unknown"
-
-            return "win" if player_team == winner else "loss"
-
-        except Exception as e:
-            logger.error(f"Помилка при аналізі матчу: {e}")
-            return "unknown"
-
-
-    def _get_recent_matches_fallback(self, player_id: str, headers: Dict[str, str]) -> tuple[int, int]:
+    def _get_recent_matches_fallback(self, player_id: str) -> tuple[int, int]:
         """Запасний метод: отримання матчів за останні 3 дні"""
         try:
             logger.info("🔄 Використовуємо запасний метод для отримання матчів")
@@ -412,33 +641,31 @@ class TwitchFACEITBot:
             from_time = int(start_date.timestamp())
             to_time = int(end_date.timestamp())
             
-            matches_url = f"https://open.faceit.com/data/v4/players/{player_id}/history"
+            matches_url = f"{FACEIT_API_BASE}/players/{player_id}/history"
             params = {
                 'game': 'cs2',
                 'from': from_time,
                 'to': to_time,
                 'limit': 50
             }
-            
-            response = requests.get(matches_url, headers=headers, params=params, timeout=15)
-            
-            if response.status_code != 200:
-                logger.error(f"Запасний метод також не працює: {response.status_code}")
-                return 0, 0
-            
-            matches_data = response.json()
+
+            response = self.http.get(matches_url, params=params, timeout=15)
+            self._note_rate_limit(response)
+            response.raise_for_status()
+
+            matches_data = _json_loads(response.content)
             matches = matches_data.get('items', [])
             
             logger.info(f"📈 Знайдено матчів за останні 3 дні: {len(matches)}")
             
             if matches:
                 logger.info("Приклад структури матчу:")
-                logger.info(json.dumps(matches[0], indent=2))
+                logger.info(_json_dumps(matches[0]))
             
             # Повертаємо 0, оскільки це тільки для діагностики
             return 0, 0
             
-        except Exception as e:
+        except (requests.RequestException, ValueError, KeyError) as e:
             logger.error(f"Помилка в запасному методі: {e}")
             return 0, 0
     
@@ -448,29 +675,31 @@ class TwitchFACEITBot:
     
     def handle_command(self, username: str, message: str):
         """Обробка команд від користувачів"""
-        msg = message.strip().split()
+        # Швидкий фільтр: звичайний чат — не команда, виходимо одразу
+        if not message.startswith('!'):
+            return
 
-        if len(msg) >= 1 and msg[0].lower() == "!elo":
+        msg = message.split()
+        command = msg[0].lower()
+
+        if command == "!elo":
             if len(msg) > 1:  # є аргумент після !elo
                 target_user = msg[1].lstrip('@')  # тільки перше слово після !elo
             else:  # тільки !elo
                 target_user = username
             self._handle_elo_command(target_user)
+            return
 
-        elif message.strip().lower() == "!checkelo":
-            self._handle_checkelo_command(username)
-
-        elif message.strip().lower() == "!debug":
-            self._handle_debug_command(username)
+        handler = self._commands.get(command)
+        if handler:
+            self._run_in_background(handler, username)
 
-        elif message.strip().lower() == "!testapi":
-            self._handle_testapi_command(username)
+    def _run_in_background(self, handler, username: str):
+        """Запускає обробник команди у фоновому потоці, щоб не блокувати IRC-цикл API-запитами"""
+        threading.Thread(target=handler, args=(username,), daemon=True).start()
     
     def _handle_elo_command(self, username: str):
         """Обробка команди !elo з фоновою обробкою та cooldown"""
-        import threading
-        import time
-
         current_time = time.time()
 
         # Якщо cooldown ще не пройшов
@@ -497,12 +726,8 @@ class TwitchFACEITBot:
                 self.send_message(f"@{username} Статистика недоступна.")
                 return
 
-            # Читаємо історію Elo
-            if os.path.exists(self.ELO_FILE):
-                with open(self.ELO_FILE, 'r', encoding='utf-8') as f:
-                    history = json.load(f)
-            else:
-                history = []
+            # Історія Elo вже в пам'яті
+            history = self._elo_history
 
             # Перевіряємо, чи є перший запис після 04:00 сьогодні
             today = now.date()
@@ -514,21 +739,20 @@ class TwitchFACEITBot:
                     break
 
             # Якщо записів після 04:00 сьогодні нема, створюємо новий із поточним Elo
+            new_records = []
             if not first_after_4am:
-                history.append({
+                new_records.append({
                     "elo": stats['Elo'],
                     "timestamp": now.isoformat()
                 })
 
             # Завжди додаємо новий запис як останній
-            history.append({
+            new_records.append({
                 "elo": stats['Elo'],
                 "timestamp": now.isoformat()
             })
 
-            # Зберігаємо історію
-            with open(self.ELO_FILE, 'w', encoding='utf-8') as f:
-                json.dump(history, f, indent=2, ensure_ascii=False)
+            self._add_elo_records(new_records)
 
             # Розрахунок денного приросту
             daily_records = [
@@ -556,36 +780,12 @@ class TwitchFACEITBot:
 
             self.send_message(response)
 
-            # Оновлюємо час останнього запиту після завершення
-            self.last_elo_time = time.time()
-
         except Exception as e:
             logger.error(f"Помилка під час обробки !elo: {e}")
             self.send_message(f"@{username} ❌ Сталася помилка при отриманні Elo")
-
-
-    def _process_elo(self, username: str):
-        """Фонова обробка та відправка фінальної статистики"""
-        stats = self.get_faceit_stats(self.FACEIT_NICK)
-        daily_change = self.get_daily_elo_change()
-
-        if stats['Elo'] > 0:
-            self.save_elo_record(stats['Elo'])
-
-        change_str = f"+{daily_change}" if daily_change > 0 else str(daily_change)
-
-        response = (
-            f"@{username} → Elo: {stats['Elo']} | "
-            f"Win: {stats['Win']} | "
-            f"Lose: {stats['Lose']} | "
-            f"{change_str}"
-        )
-
-        self.send_message(response)
-
-        # Встановлюємо останній час після завершення обробки
-        self.last_elo_time = time.time()
-
+        finally:
+            # Оновлюємо час останнього запиту навіть після помилки
+            self.last_elo_time = time.time()
 
     def _handle_checkelo_command(self, username: str):
         """Обробка команди !checkelo (виводить в консоль)"""
@@ -620,19 +820,17 @@ class TwitchFACEITBot:
     def _handle_debug_command(self, username: str):
         """Обробка команди !debug - детальна діагностика"""
         logger.info(f"Обробка команди !debug від {username}")
-        
-        headers = {'Authorization': f'Bearer {self.FACEIT_API_KEY}'}
-        
+
         try:
             # Тест 1: Перевірка player endpoint
-            player_url = f"https://open.faceit.com/data/v4/players?nickname={self.FACEIT_NICK}"
-            response = requests.get(player_url, headers=headers, timeout=10)
+            player_url = f"{FACEIT_API_BASE}/players?nickname={self.FACEIT_NICK}"
+            response = self.http.get(player_url, timeout=10)
             
             print(f"\n=== DEBUG для @{username} ===")
             print(f"1. Player API статус: {response.status_code}")
             
             if response.status_code == 200:
-                player_data = response.json()
+                player_data = _json_loads(response.content)
                 player_id = player_data.get('player_id')
                 print(f"   Player ID: {player_id}")
                 print(f"   Nickname: {player_data.get('nickname')}")
@@ -642,20 +840,19 @@ class TwitchFACEITBot:
                 
                 # Тест 2: Перевірка matches endpoint
                 if player_id:
-                    today = datetime.datetime.now(self.TIMEZONE)
-                    yesterday = today - datetime.timedelta(days=1)
-                    
-                    from_time = int(yesterday.timestamp())
-                    to_time = int(today.timestamp())
-                    
-                    matches_url = f"https://open.faceit.com/data/v4/players/{player_id}/history"
+                    # Остання доба в epoch-секундах
+                    to_time = int(time.time())
+                    from_time = to_time - 86400
+
+
+                    matches_url = f"{FACEIT_API_BASE}/players/{player_id}/history"
                     params = {'game': 'cs2', 'from': from_time, 'to': to_time, 'limit': 10}
-                    
-                    matches_response = requests.get(matches_url, headers=headers, params=params, timeout=10)
+
+                    matches_response = self.http.get(matches_url, params=params, timeout=10)
                     print(f"2. Matches API статус: {matches_response.status_code}")
                     
                     if matches_response.status_code == 200:
-                        matches_data = matches_response.json()
+                        matches_data = _json_loads(matches_response.content)
                         matches = matches_data.get('items', [])
                         print(f"   Знайдено матчів за останню добу: {len(matches)}")
                         
@@ -678,48 +875,52 @@ class TwitchFACEITBot:
     def _handle_testapi_command(self, username: str):
         """Тест API з різними параметрами"""
         logger.info(f"Тестування API для {username}")
-        
-        headers = {'Authorization': f'Bearer {self.FACEIT_API_KEY}'}
-        
+
         try:
             # Отримуємо player_id
-            player_url = f"https://open.faceit.com/data/v4/players?nickname={self.FACEIT_NICK}"
-            response = requests.get(player_url, headers=headers, timeout=10)
+            player_url = f"{FACEIT_API_BASE}/players?nickname={self.FACEIT_NICK}"
+            response = self.http.get(player_url, timeout=10)
             
             if response.status_code != 200:
                 self.send_message(f"@{username} API помилка: {response.status_code}")
                 return
             
-            player_data = response.json()
+            player_data = _json_loads(response.content)
             player_id = player_data.get('player_id')
             
             if not player_id:
                 self.send_message(f"@{username} Player ID не знайдено")
                 return
             
-            # Тестуємо різні періоди
-            now = datetime.datetime.now(self.TIMEZONE)
+            # Тестуємо різні періоди (межі рахуємо в epoch-секундах)
+            now_ts = int(time.time())
             periods = [
                 ("Сьогодні", 0),
                 ("Вчора", 1),
                 ("2 дні тому", 2),
                 ("Тиждень", 7)
             ]
-            
-            for period_name, days_ago in periods:
-                start_date = now - datetime.timedelta(days=days_ago+1)
-                end_date = now - datetime.timedelta(days=days_ago) if days_ago > 0 else now
-                
-                from_time = int(start_date.timestamp())
-                to_time = int(end_date.timestamp())
-                
-                matches_url = f"https://open.faceit.com/data/v4/players/{player_id}/history"
-                params = {'game': 'cs2', 'from': from_time, 'to': to_time, 'limit': 20}
-                
-                matches_response = requests.get(matches_url, headers=headers, params=params, timeout=10)
-                
+
+            matches_url = f"{FACEIT_API_BASE}/players/{player_id}/history"
+            param_list = [
+                (period_name,
+                 {'game': 'cs2',
+                  'from': now_ts - (days_ago + 1) * 86400,
+                  'to': now_ts - days_ago * 86400 if days_ago > 0 else now_ts,
+                  'limit': 20})
+                for period_name, days_ago in periods
+            ]
+
+            # Всі періоди запитуємо паралельно: латентність одного RTT замість суми чотирьох
+            with ThreadPoolExecutor(max_workers=4) as executor:
+                responses = list(executor.map(
+                    lambda item: self.http.get(matches_url, params=item[1], timeout=10),
+                    param_list
+                ))
+
+            for (period_name, _), matches_response in zip(param_list, responses):
                 if matches_response.status_code == 200:
-                    matches_data = matches_response.json()
+                    matches_data = _json_loads(matches_response.content)
                     matches_count = len(matches_data.get('items', []))
                     print(f"{period_name}: {matches_count} матчів")
                 else:
@@ -738,7 +939,7 @@ class TwitchFACEITBot:
 
         while self.running:
             try:
-                if not self.is_stream_live():
+                if not self._is_stream_live_cached():
                     logger.info("Стрім не активний. Бот чекає...")
                     time.sleep(60)  # Перевіряти кожну хвилину
                     continue
@@ -750,22 +951,32 @@ class TwitchFACEITBot:
 
                 self.clean_old_elo_records()
 
-                while self.running and self.is_stream_live():
+                while self.running and self._is_stream_live_cached():
                     try:
-                        response = self.irc.recv(2048).decode('utf-8', errors='ignore')
-                        if not response:
+                        raw = self._sock_file.readline()
+                        if not raw:
                             logger.warning("Порожня відповідь від сервера, перепідключення...")
                             self._reconnect()
                             continue
 
-                        if response.startswith('PING'):
-                            self.irc.send("PONG\r\n".encode('utf-8'))
+                        self._last_activity = time.monotonic()
+                        line = raw.decode('utf-8', errors='replace').rstrip('\r\n')
+
+                        if line.startswith('PING'):
+                            self.irc.sendall(b"PONG\r\n")
                             continue
 
-                        if "PRIVMSG" in response:
-                            self._parse_message(response)
+                        if "PRIVMSG" in line:
+                            self._parse_message(line)
 
-                    except (socket.timeout, ConnectionResetError, ConnectionAbortedError) as e:
+                    except socket.timeout:
+                        # Тиша — ще не розрив: перепідключаємось лише якщо даних
+                        # немає довше за dead_connection_timeout
+                        if time.monotonic() - self._last_activity > self.dead_connection_timeout:
+                            logger.warning("Немає даних від сервера, перепідключення...")
+                            self._reconnect()
+                            time.sleep(5)
+                    except (ConnectionResetError, ConnectionAbortedError) as e:
                         logger.warning(f"Розрив з'єднання: {e}, перепідключення...")
                         self._reconnect()
                         time.sleep(5)
@@ -777,8 +988,7 @@ class TwitchFACEITBot:
                         time.sleep(1)
 
                 logger.info("Стрім завершено або бот зупинено. Очікування наступного стріму...")
-                if self.irc:
-                    self.irc.close()
+                self._close_socket()
                 time.sleep(60)
 
             except KeyboardInterrupt:
@@ -789,24 +999,38 @@ class TwitchFACEITBot:
                 time.sleep(5)
 
     
-    def _parse_message(self, response: str):
+    def _parse_message(self, line: str):
         """Парсинг повідомлення з чату"""
         try:
-            # Витягуємо ім'я користувача та повідомлення
-            username = response.split('!', 1)[0][1:]
-            message = response.split('PRIVMSG', 1)[1].split(':', 1)[1].strip()
-            
+            # Витягуємо ім'я користувача та повідомлення одним matched-ом
+            match = self._privmsg_re.match(line)
+            if not match:
+                return
+
+            username = match.group(1)
+            message = match.group(2).strip()
+
             logger.info(f"{username}: {message}")
             self.handle_command(username, message)
-            
+
         except Exception as e:
             logger.error(f"Помилка при парсингу повідомлення: {e}")
     
+    def _close_socket(self):
+        """Закриває reader та сокет IRC"""
+        if self._sock_file:
+            try:
+                self._sock_file.close()
+            except OSError:
+                pass
+            self._sock_file = None
+        if self.irc:
+            self.irc.close()
+
     def _reconnect(self):
         """Перепідключення до Twitch"""
         try:
-            if self.irc:
-                self.irc.close()
+            self._close_socket()
             time.sleep(5)
             self.connect_to_twitch()
         except Exception as e:
@@ -815,8 +1039,8 @@ class TwitchFACEITBot:
     def stop(self):
         """Зупинка бота"""
         self.running = False
-        if self.irc:
-            self.irc.close()
+        self._flush_elo_history()
+        self._close_socket()
         logger.info("Бот зупинено")
 
 def main():